@@ -1,10 +1,8 @@
 """Private module that determines how data is encoded and serialized, to be able to send it over a wire, or save to disk"""
 
-import base64
-import io
+import functools
 import json
 import numbers
-import uuid
 import struct
 
 import numpy as np
@@ -12,7 +10,34 @@ import pyarrow as pa
 import vaex
 from .datatype import DataType
 
+try:
+    # SIMD accelerated, drop in replacement
+    from pybase64 import b64encode, b64decode
+except ImportError:
+    from base64 import b64encode, b64decode
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 registry = {}
+# smaller blobs are not worth hashing to find duplicates
+_blob_dedup_min_size = 4096
+
+
+def _json_default(obj):
+    # numeric numpy scalars can be passed as is, other custom objects should be encoded before serializing
+    # timedelta64 is a subclass of np.signedinteger, but .item() would drop its unit
+    if isinstance(obj, (np.number, np.bool_)) and not isinstance(obj, np.timedelta64):
+        value = obj.item()
+        # e.g. np.longdouble.item() returns itself, which would make json call us again
+        if type(value) in (int, float, bool):
+            return value
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _json_dumps(data):
+    return json.dumps(data, default=_json_default)
 
 
 def register(name):
@@ -60,6 +85,11 @@ class vaex_rmi_result_encoding:
 class vaex_evaluate_results_encoding:
     @classmethod
     def encode(cls, encoding, result):
+        if isinstance(result, list) and result:
+            if all(isinstance(k, np.ndarray) for k in result):
+                return {'type': 'ndarray-list', 'data': encoding.encode('ndarray-list', result)}
+            if cls._is_numpy_scalar_list(result):
+                return {'type': 'numpy-scalar-list', 'data': encoding.encode('numpy-scalar-list', result)}
         if isinstance(result, (list, tuple)):
             return [cls.encode(encoding, k) for k in result]
         else:
@@ -68,10 +98,8 @@ class vaex_evaluate_results_encoding:
             elif isinstance(result, vaex.array_types.supported_arrow_array_types):
                 return {'type': 'arrow-array', 'data': encoding.encode('arrow-array', result)}
             elif isinstance(result, numbers.Number):
-                try:
-                    result = result.item()  # for numpy scalars
-                except:  # noqa
-                    pass
+                if isinstance(result, np.generic):
+                    result = result.item()
                 return {'type': 'json', 'data': result}
             else:
                 raise ValueError('Cannot encode: %r' % result)
@@ -83,19 +111,67 @@ class vaex_evaluate_results_encoding:
         else:
             return encoding.decode(result_encoded['type'], result_encoded['data'])
 
+    @staticmethod
+    def _is_numpy_scalar_list(result):
+        scalar_type = type(result[0])
+        return issubclass(scalar_type, np.generic) and issubclass(scalar_type, numbers.Number) and all(type(k) is scalar_type for k in result)
+
+
+@register("ndarray-list")
+class ndarray_list_encoding:
+    @classmethod
+    def encode(cls, encoding, arrays):
+        return encoding.encode_list('ndarray', arrays)
+
+    @classmethod
+    def decode(cls, encoding, arrays_encoded):
+        return encoding.decode_list('ndarray', arrays_encoded)
+
+
+@register("numpy-scalar-list")
+class numpy_scalar_list_encoding:
+    # many scalars of the same type (e.g. aggregation results) are sent as a single array
+    @classmethod
+    def encode(cls, encoding, scalars):
+        return encoding.encode('ndarray', np.asarray(scalars))
+
+    @classmethod
+    def decode(cls, encoding, scalars_encoded):
+        return encoding.decode('ndarray', scalars_encoded).tolist()
 
 
 @register("arrow-array")
 class arrow_array_encoding:
     @classmethod
     def encode(cls, encoding, array):
-        blob = pa.serialize(array).to_buffer()
-        return {'arrow-serialized-blob': encoding.add_blob(blob)}
+        if isinstance(array, pa.ChunkedArray):
+            batches = [pa.record_batch([chunk], names=['x']) for chunk in array.chunks]
+            schema = pa.schema([('x', array.type)])
+        else:
+            batches = [pa.record_batch([array], names=['x'])]
+            schema = batches[0].schema
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        encoded = {'arrow-ipc-blob': encoding.add_blob(sink.getvalue())}
+        if isinstance(array, pa.ChunkedArray):
+            encoded['chunked'] = True
+        return encoded
 
     @classmethod
     def decode(cls, encoding, result_encoded):
-        blob = encoding.get_blob(result_encoded['arrow-serialized-blob'])
-        return pa.deserialize(blob)
+        if 'arrow-serialized-blob' in result_encoded:
+            # pa.deserialize is deprecated, and removed from recent pyarrow versions
+            raise RuntimeError("legacy 'arrow-serialized-blob' format no longer supported; re-encode with current vaex")
+        blob = encoding.get_blob(result_encoded['arrow-ipc-blob'])
+        table = pa.ipc.open_stream(pa.BufferReader(blob)).read_all()
+        column = table.column(0)
+        if result_encoded.get('chunked'):
+            return column
+        if column.num_chunks == 1:
+            return column.chunk(0)
+        return pa.concat_arrays(column.chunks)
 
 
 @register("ndarray")
@@ -113,7 +189,16 @@ class ndarray_encoding:
             values = array
         if values.dtype.kind in 'mM':
             values = values.view(np.uint64)
+        strings = None
         if values.dtype.kind == 'O':
+            strings = cls._to_arrow_strings(values)
+        if strings is not None:
+            data = {
+                    'arrow_values': encoding.encode('arrow-array', strings),
+                    'shape': array.shape,
+                    'dtype': encoding.encode('dtype', DataType(dtype))
+            }
+        elif values.dtype.kind == 'O':
             data = {
                     'values': values.tolist(),  # rely on json encoding
                     'shape': array.shape,
@@ -136,7 +221,10 @@ class ndarray_encoding:
         else:
             dtype = encoding.decode('dtype', result_encoded['dtype'])
             shape = result_encoded['shape']
-            if dtype.kind == 'O':
+            if 'arrow_values' in result_encoded:
+                strings = encoding.decode('arrow-array', result_encoded['arrow_values'])
+                array = strings.to_numpy(zero_copy_only=False).reshape(shape)
+            elif dtype.kind == 'O':
                 data = result_encoded['values']
                 array = np.array(data, dtype=dtype.numpy)
             else:
@@ -148,16 +236,46 @@ class ndarray_encoding:
                 array = np.ma.array(array, mask=mask_array)
             return array
 
+    @staticmethod
+    def _to_arrow_strings(values):
+        # object arrays are mostly strings, which arrow stores much more efficiently than a json list
+        try:
+            strings = pa.array(values.ravel())
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+        if pa.types.is_string(strings.type) or pa.types.is_large_string(strings.type):
+            return strings
+
+
+# str(dtype) and np.dtype(type_spec) are relatively expensive, and the same types are encoded many times
+# the caches are bounded, since type specs can come from clients
+@functools.lru_cache(maxsize=128)
+def _dtype_to_str(dtype):
+    return str(dtype)
+
+
+@functools.lru_cache(maxsize=128)
+def _dtype_from_str(type_spec):
+    return dtype_encoding._decode(type_spec)
+
 
 @register("dtype")
 class dtype_encoding:
     @staticmethod
     def encode(encoding, dtype):
         dtype = dtype.internal
-        return str(dtype)
+        if not isinstance(dtype, np.dtype):
+            return str(dtype)
+        return _dtype_to_str(dtype)
 
     @staticmethod
     def decode(encoding, type_spec):
+        if not isinstance(type_spec, str):  # not hashable, so we cannot cache it
+            return dtype_encoding._decode(type_spec)
+        return _dtype_from_str(type_spec)
+
+    @staticmethod
+    def _decode(type_spec):
         if type_spec == 'string':
             return DataType(pa.string())
         if type_spec == 'large_string':
@@ -217,14 +335,31 @@ class grid_encoding:
 class Encoding:
     def __init__(self, next=None):
         self.registry = {**registry}
-        self.blobs = {}
+        self.blobs = []
+        self._blob_ids_by_hash = {}
+        # bound encode/decode methods, to avoid the registry lookup for each value
+        self._encoders = {}
+        self._decoders = {}
+
+    def _get_encoder(self, typename):
+        encoder = self._encoders.get(typename)
+        if encoder is None:
+            encoder = self._encoders[typename] = self.registry[typename].encode
+        return encoder
+
+    def _get_decoder(self, typename):
+        decoder = self._decoders.get(typename)
+        if decoder is None:
+            decoder = self._decoders[typename] = self.registry[typename].decode
+        return decoder
 
     def encode(self, typename, value):
-        encoded = self.registry[typename].encode(self, value)
+        encoded = self._get_encoder(typename)(self, value)
         return encoded
 
     def encode_list(self, typename, values):
-        encoded = [self.registry[typename].encode(self, k) for k in values]
+        encoder = self._get_encoder(typename)
+        encoded = [encoder(self, k) for k in values]
         return encoded
 
     def encode_list2(self, typename, values):
@@ -232,15 +367,17 @@ class Encoding:
         return encoded
 
     def encode_dict(self, typename, values):
-        encoded = {key: self.registry[typename].encode(self, value) for key, value in values.items()}
+        encoder = self._get_encoder(typename)
+        encoded = {key: encoder(self, value) for key, value in values.items()}
         return encoded
 
     def decode(self, typename, value, **kwargs):
-        decoded = self.registry[typename].decode(self, value, **kwargs)
+        decoded = self._get_decoder(typename)(self, value, **kwargs)
         return decoded
 
     def decode_list(self, typename, values, **kwargs):
-        decoded = [self.registry[typename].decode(self, k, **kwargs) for k in values]
+        decoder = self._get_decoder(typename)
+        decoded = [decoder(self, k, **kwargs) for k in values]
         return decoded
 
     def decode_list2(self, typename, values, **kwargs):
@@ -248,76 +385,96 @@ class Encoding:
         return decoded
 
     def decode_dict(self, typename, values, **kwargs):
-        decoded = {key: self.registry[typename].decode(self, value, **kwargs) for key, value in values.items()}
+        decoder = self._get_decoder(typename)
+        decoded = {key: decoder(self, value, **kwargs) for key, value in values.items()}
         return decoded
 
     def add_blob(self, buffer):
-        blob_id = str(uuid.uuid4())
-        self.blobs[blob_id] = memoryview(buffer).tobytes()
+        blob_id = len(self.blobs)
+        view = memoryview(buffer)
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        # keep a reference to the original memory, bytes are only copied when serializing
+        view = view.cast('B')
+        if xxhash is not None and view.nbytes >= _blob_dedup_min_size:
+            # identical blobs (e.g. the same mask for many aggregations) are only sent once
+            key = (xxhash.xxh3_64_intdigest(view), view.nbytes)
+            existing_id = self._blob_ids_by_hash.get(key)
+            if existing_id is not None:
+                existing = self.blobs[existing_id]
+                # guard against hash collisions
+                if np.array_equal(np.frombuffer(existing, dtype=np.uint8), np.frombuffer(view, dtype=np.uint8)):
+                    return f'blob:{existing_id}'
+            else:
+                self._blob_ids_by_hash[key] = blob_id
+        self.blobs.append(view)
         return f'blob:{blob_id}'
 
     def get_blob(self, blob_ref):
         assert blob_ref.startswith('blob:')
         blob_id = blob_ref[5:]
-        return self.blobs[blob_id]
+        if isinstance(self.blobs, dict):  # uuid keyed blobs, written by older versions
+            return self.blobs[blob_id]
+        return self.blobs[int(blob_id)]
 
 
 class inline:
     @staticmethod
     def serialize(data, encoding):
-        import base64
-        blobs = {key: base64.b64encode(value).decode('ascii') for key, value in encoding.blobs.items()}
-        return json.dumps({'data': data, 'blobs': blobs})
+        blobs = [b64encode(value).decode('ascii') for value in encoding.blobs]
+        return _json_dumps({'data': data, 'blobs': blobs})
 
     @staticmethod
     def deserialize(data, encoding):
         data = json.loads(data)
-        encoding.blobs = {key: base64.b64decode(value.encode('ascii')) for key, value in data['blobs'].items()}
+        if isinstance(data['blobs'], dict):
+            encoding.blobs = {key: b64decode(value.encode('ascii')) for key, value in data['blobs'].items()}
+        else:
+            encoding.blobs = [b64decode(value.encode('ascii')) for value in data['blobs']]
         return data['data']
 
 
 def _pack_blobs(*blobs):
+    blobs = [memoryview(blob).cast('B') for blob in blobs]
     count = len(blobs)
-    lenghts = [len(blob) for blob in blobs]
-    stream = io.BytesIO()
     # header: <number of blobs>,<offset 0>, ... <offset N-1> with 8 byte unsigned ints
     header_length = 8 * (2 + count)
-    offsets = (np.cumsum([0] + lenghts) + header_length).tolist()
-    stream.write(struct.pack(f'{count+2}q', count, *offsets))
+    offsets = [header_length]
+    offset = header_length
     for blob in blobs:
-        stream.write(blob)
-    bytes = stream.getvalue()
-    assert offsets[-1] == len(bytes)
-    return bytes
+        offset += blob.nbytes
+        offsets.append(offset)
+    header = struct.pack(f'{count+2}q', count, *offsets)
+    # join allocates the result once and copies each blob directly into it
+    data = b''.join([header, *blobs])
+    assert offsets[-1] == len(data)
+    return data
 
 
-def _unpack_blobs(bytes):
-    stream = io.BytesIO(bytes)
-
-    count, = struct.unpack('q', stream.read(8))
-    offsets = struct.unpack(f'{count+1}q', stream.read(8 * (count + 1)))
-    assert offsets[-1] == len(bytes)
-    blobs = []
-    for i1, i2 in zip(offsets[:-1], offsets[1:]):
-        blobs.append(bytes[i1:i2])
-    return blobs
+def _unpack_blobs(data):
+    # slices of a memoryview share the memory, so the blobs are not copied
+    view = memoryview(data).cast('B')
+    count = int(np.frombuffer(view[:8], dtype=np.int64)[0])
+    offsets = np.frombuffer(view[8:8 * (count + 2)], dtype=np.int64).tolist()
+    assert offsets[-1] == view.nbytes
+    return [view[i1:i2] for i1, i2 in zip(offsets[:-1], offsets[1:])]
 
 
 class binary:
     @staticmethod
     def serialize(data, encoding):
-        blob_refs = list(encoding.blobs.keys())
-        blobs = [encoding.blobs[k] for k in blob_refs]
-        json_blob = json.dumps({'data': data, 'blob_refs': blob_refs})
-        return _pack_blobs(json_blob.encode('utf8'), *blobs)
+        json_blob = _json_dumps({'data': data})
+        return _pack_blobs(json_blob.encode('utf8'), *encoding.blobs)
 
     @staticmethod
     def deserialize(data, encoding):
         json_data, *blobs = _unpack_blobs(data)
-        json_data = json_data.decode('utf8')
-        json_data = json.loads(json_data)
+        json_data = json.loads(str(json_data, 'utf8'))
         data = json_data['data']
-        encoding.blobs = {key: blob for key, blob in zip(json_data['blob_refs'], blobs)}
+        if 'blob_refs' in json_data:
+            encoding.blobs = {key: blob for key, blob in zip(json_data['blob_refs'], blobs)}
+        else:
+            encoding.blobs = blobs
         return data
 
 
@@ -8,10 +8,13 @@ import pyarrow as pa
 
 
 serializers = []
+# can_encode only depends on the type, so we remember which serializer (or None) handles each type
+_serializer_by_type = {}
 
 
 def register(cls):
     serializers.append(cls)
+    _serializer_by_type.clear()
     return cls
 
 
@@ -143,10 +146,20 @@ class OrdererSetSerializer:
         return value
 
 
-def encode(obj):
+def _find_serializer(obj):
     for serializer in serializers:
         if serializer.can_encode(obj):
-            return serializer.encode(obj)
+            return serializer
+
+
+def encode(obj):
+    cls = type(obj)
+    try:
+        serializer = _serializer_by_type[cls]
+    except KeyError:
+        serializer = _serializer_by_type[cls] = _find_serializer(obj)
+    if serializer is not None:
+        return serializer.encode(obj)
 
 
 class VaexJsonEncoder(json.JSONEncoder):
@@ -1,6 +1,7 @@
 import vaex.encoding
 import numpy as np
 import pyarrow as pa
+import pytest
 
 @vaex.encoding.register('blobtest')
 class encoding:
@@ -98,3 +99,149 @@ def test_encoding_numpy_string_objects():
     data = vaex.encoding.deserialize(wiredata, encoding)
     value = encoding.decode('ndarray', data)
     assert np.all(value == x)
+
+
+def test_encoding_numpy_non_contiguous():
+    x = np.arange(20, dtype='f8').reshape(4, 5)[:, ::2]
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('ndarray', x)
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('ndarray', data)
+    assert np.all(value == x)
+
+
+def test_encoding_inline_uuid_blobs():
+    # older versions keyed the blobs by uuid
+    import base64
+    import json
+    blob = base64.b64encode(np.arange(3, dtype='i8').tobytes()).decode('ascii')
+    wiredata = json.dumps({'data': {'values': 'blob:1f6a2b7c', 'shape': [3], 'dtype': 'int64'}, 'blobs': {'1f6a2b7c': blob}})
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.inline.deserialize(wiredata, encoding)
+    value = encoding.decode('ndarray', data)
+    assert value.tolist() == [0, 1, 2]
+
+
+def test_encoding_json_nan():
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('vaex-evaluate-result', [np.float64(np.nan), 1.5])
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('vaex-evaluate-result', data)
+    assert np.isnan(value[0])
+    assert value[1] == 1.5
+
+
+def test_encoding_numpy_mixed_objects():
+    x = np.array([1, 'vaex', None], dtype=object)
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('ndarray', x)
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('ndarray', data)
+    assert value.tolist() == x.tolist()
+
+
+def test_encoding_evaluate_result_ndarray_list():
+    x = [np.arange(3, dtype='f8'), np.arange(4, dtype='i4')]
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('vaex-evaluate-result', x)
+    assert data['type'] == 'ndarray-list'
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('vaex-evaluate-result', data)
+    assert len(value) == 2
+    assert value[0].tolist() == x[0].tolist()
+    assert value[1].tolist() == x[1].tolist()
+
+
+def test_encoding_arrow_chunked():
+    x = pa.chunked_array([['vaex', None], ['fast']])
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('arrow-array', x)
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('arrow-array', data)
+    assert isinstance(value, pa.ChunkedArray)
+    assert value.to_pylist() == x.to_pylist()
+
+
+@pytest.mark.skipif(vaex.encoding.xxhash is None, reason='xxhash not installed')
+def test_encoding_blob_dedup():
+    mask = np.arange(10000) % 3 == 0
+    x = [np.ma.array(np.arange(10000, dtype='f8'), mask=mask), np.ma.array(np.arange(10000, dtype='i8'), mask=mask)]
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode_list('ndarray', x)
+    assert data[0]['mask'] == data[1]['mask']
+    assert len(encoding.blobs) == 3
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode_list('ndarray', data)
+    assert value[1].tolist() == x[1].tolist()
+
+
+def test_encoding_numpy_scalars_in_json():
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('json', {'min': np.float32(1.5), 'count': np.int64(3), 'max': np.nan})
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('json', data)
+    assert value['min'] == 1.5
+    assert value['count'] == 3
+    assert np.isnan(value['max'])
+
+
+def test_encoding_evaluate_result_numpy_scalar_list():
+    x = [np.float64(1.5), np.float64(np.nan), np.float64(3)]
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('vaex-evaluate-result', x)
+    assert data['type'] == 'numpy-scalar-list'
+    wiredata = vaex.encoding.serialize(data, encoding)
+
+    encoding = vaex.encoding.Encoding()
+    data = vaex.encoding.deserialize(wiredata, encoding)
+    value = encoding.decode('vaex-evaluate-result', data)
+    assert value[0] == 1.5
+    assert np.isnan(value[1])
+    assert value[2] == 3
+
+
+def test_encoding_arrow_legacy_serialized_blob():
+    encoding = vaex.encoding.Encoding()
+    data = {'arrow-serialized-blob': encoding.add_blob(b'1234')}
+    with pytest.raises(RuntimeError, match='no longer supported'):
+        encoding.decode('arrow-array', data)
+
+
+def test_encoding_json_big_integers():
+    x = {'a': 2**70, 'b': -2**63 - 1, 'c': 2**64 - 1}
+    encoding = vaex.encoding.Encoding()
+    data = encoding.encode('json', x)
+    for serializer in [vaex.encoding.binary, vaex.encoding.inline]:
+        wiredata = serializer.serialize(data, encoding)
+        value = vaex.encoding.Encoding().decode('json', serializer.deserialize(wiredata, vaex.encoding.Encoding()))
+        assert value == x
+        assert all(type(v) is int for v in value.values())
+
+
+def test_encoding_numpy_datetime_scalar_in_json():
+    for value in [np.datetime64('2001-01-01', 'ns'), np.timedelta64(5, 'ns'), np.bytes_(b'vaex'), np.longdouble(1.5), np.clongdouble(1.5)]:
+        encoding = vaex.encoding.Encoding()
+        data = encoding.encode('json', {'value': value})
+        with pytest.raises(TypeError, match=type(value).__name__):
+            vaex.encoding.serialize(data, encoding)
@@ -0,0 +1,30 @@
+import vaex.json
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def test_serializer_cache_cleared_on_register():
+    point = Point(1, 2)
+    assert vaex.json.encode(point) is None
+    assert vaex.json._serializer_by_type[Point] is None
+
+    class PointSerializer:
+        @staticmethod
+        def can_encode(obj):
+            return isinstance(obj, Point)
+
+        @staticmethod
+        def encode(obj):
+            return {'type': 'point', 'data': [obj.x, obj.y]}
+
+    vaex.json.register(PointSerializer)
+    try:
+        assert vaex.json.encode(point) == {'type': 'point', 'data': [1, 2]}
+        assert vaex.json._serializer_by_type[Point] is PointSerializer
+    finally:
+        vaex.json.serializers.remove(PointSerializer)
+        vaex.json._serializer_by_type.clear()